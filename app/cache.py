@@ -0,0 +1,46 @@
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Tuple
+
+
+class AsyncTTLCache:
+    """
+    Small in-process LRU cache with a TTL, for async producers.
+    The pending future is stored (not the value), so concurrent callers
+    for the same key share one upstream request (single-flight).
+    Failed lookups are evicted so the next caller retries.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, asyncio.Future]]" = OrderedDict()
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_set(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        async with self._lock:
+            now = time.monotonic()
+            entry = self._data.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                fut = entry[1]
+            else:
+                self.misses += 1
+                fut = asyncio.ensure_future(factory())
+                self._data[key] = (now + self.ttl, fut)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+        try:
+            # shield: one cancelled caller must not cancel the shared request
+            return await asyncio.shield(fut)
+        except Exception:
+            async with self._lock:
+                entry = self._data.get(key)
+                if entry and entry[1] is fut:
+                    del self._data[key]
+            raise
@@ -1,27 +1,83 @@
 import os
 import json
-import datetime as dt
-from typing import Any, Dict, Optional
+import time
+import asyncio
+from typing import Any, Dict, List, Optional
 
+import aiohttp
 import httpx
-from kubernetes import client, config
+import orjson
+from kubernetes_asyncio import client, config
+from kubernetes_asyncio.client import ApiClient
+from kubernetes_asyncio.client.exceptions import ApiException
+from kubernetes_asyncio.client.rest import RESTResponse
 
+from app.cache import AsyncTTLCache
 
-def _load_k8s():
+
+async def k8s_api_client() -> ApiClient:
     """
     Runs in-cluster using ServiceAccount token.
     If you test locally later, it falls back to kubeconfig.
+    Created once at startup and shared; close it on shutdown.
     """
     try:
         config.load_incluster_config()
     except Exception:
-        config.load_kube_config()
+        await config.load_kube_config()
+    return ApiClient()
+
+
+# Connect/read timeouts per apiserver call, and a cap on concurrent calls so
+# an alert storm cannot pile unbounded requests onto a slow apiserver.
+# kubernetes_asyncio hands _request_timeout straight to aiohttp, so this must be
+# a ClientTimeout (or a number for a total timeout), not a (connect, read) tuple.
+K8S_REQUEST_TIMEOUT = aiohttp.ClientTimeout(connect=5, sock_read=15)
+K8S_SEM = asyncio.Semaphore(10)
+
+# Most recent events kept per pod
+K8S_MAX_EVENTS = 20
+
+
+async def _k8s_call(fn, **kwargs):
+    async with K8S_SEM:
+        return await fn(_request_timeout=K8S_REQUEST_TIMEOUT, **kwargs)
+
+
+async def _k8s_call_json(fn, **kwargs) -> Dict[str, Any]:
+    """
+    Like _k8s_call, but skips the client's model deserialization and returns
+    the raw JSON body parsed with orjson.
+    """
+    async with K8S_SEM:
+        resp = await fn(_request_timeout=K8S_REQUEST_TIMEOUT, _preload_content=False, **kwargs)
+        data = await resp.read()
+    # The client only raises on non-2xx when it preloads the body
+    if not 200 <= resp.status <= 299:
+        raise ApiException(http_resp=RESTResponse(resp, data))
+    return orjson.loads(data)
+
+
+# Fields kept per container state; the rest (containerID, signal, ...) is not useful for triage
+_STATE_FIELDS = {
+    "waiting": ("reason", "message"),
+    "running": ("startedAt",),
+    "terminated": ("reason", "message", "exitCode", "startedAt", "finishedAt"),
+}
 
 
-async def k8s_collect_evidence(namespace: Optional[str], pod: Optional[str], node: Optional[str]) -> Dict[str, Any]:
-    _load_k8s()
-    v1 = client.CoreV1Api()
-    apps = client.AppsV1Api()
+def _container_state(state: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not state:
+        return None
+    return {
+        kind: {f: detail.get(f) for f in fields}
+        for kind, fields in _STATE_FIELDS.items()
+        if (detail := state.get(kind)) is not None
+    }
+
+
+async def k8s_collect_evidence(api: ApiClient, namespace: Optional[str], pod: Optional[str], node: Optional[str]) -> Dict[str, Any]:
+    v1 = client.CoreV1Api(api)
 
     evidence: Dict[str, Any] = {
         "namespace": namespace, "pod": pod, "node": node}
@@ -29,7 +85,7 @@ async def k8s_collect_evidence(namespace: Optional[str], pod: Optional[str], nod
     # Node details (if node provided)
     if node:
         try:
-            n = v1.read_node(name=node)
+            n = await _k8s_call(v1.read_node, name=node)
             evidence["node_info"] = {
                 "name": n.metadata.name,
                 "labels": n.metadata.labels,
@@ -40,24 +96,28 @@ async def k8s_collect_evidence(namespace: Optional[str], pod: Optional[str], nod
 
     # Pod details + events + logs
     if namespace and pod:
+        # One pod read serves both pod_info and the container list for logs
+        containers: Optional[List[str]] = None
         try:
-            p = v1.read_namespaced_pod(name=pod, namespace=namespace)
+            p = await _k8s_call_json(v1.read_namespaced_pod, name=pod, namespace=namespace)
+            meta, spec, pstatus = p.get("metadata") or {}, p.get("spec") or {}, p.get("status") or {}
+            containers = [c["name"] for c in (spec.get("containers") or [])]
             evidence["pod_info"] = {
-                "name": p.metadata.name,
-                "namespace": p.metadata.namespace,
-                "node_name": p.spec.node_name,
-                "labels": p.metadata.labels,
-                "phase": p.status.phase,
-                "conditions": [{"type": c.type, "status": c.status, "reason": c.reason, "message": c.message} for c in (p.status.conditions or [])],
+                "name": meta.get("name"),
+                "namespace": meta.get("namespace"),
+                "node_name": spec.get("nodeName"),
+                "labels": meta.get("labels"),
+                "phase": pstatus.get("phase"),
+                "conditions": [{"type": c.get("type"), "status": c.get("status"), "reason": c.get("reason"), "message": c.get("message")} for c in (pstatus.get("conditions") or [])],
                 "container_statuses": [
                     {
-                        "name": cs.name,
-                        "ready": cs.ready,
-                        "restart_count": cs.restart_count,
-                        "state": cs.state.to_dict() if cs.state else None,
-                        "last_state": cs.last_state.to_dict() if cs.last_state else None,
+                        "name": cs.get("name"),
+                        "ready": cs.get("ready"),
+                        "restart_count": cs.get("restartCount"),
+                        "state": _container_state(cs.get("state")),
+                        "last_state": _container_state(cs.get("lastState")),
                     }
-                    for cs in (p.status.container_statuses or [])
+                    for cs in (pstatus.get("containerStatuses") or [])
                 ],
             }
         except Exception as e:
@@ -65,11 +125,20 @@ async def k8s_collect_evidence(namespace: Optional[str], pod: Optional[str], nod
 
         # Events
         try:
-            ev = v1.list_namespaced_event(
+            ev = await _k8s_call(
+                v1.list_namespaced_event,
                 namespace=namespace,
                 field_selector=f"involvedObject.name={pod}",
-                limit=50
+                # Served from the apiserver watch cache instead of a quorum read from etcd
+                resource_version="0",
+                limit=K8S_MAX_EVENTS,
             )
+            # Watch-cache reads may ignore limit, so enforce it here: newest first
+            items = sorted(
+                ev.items or [],
+                key=lambda i: (i.last_timestamp is not None, i.last_timestamp),
+                reverse=True,
+            )[:K8S_MAX_EVENTS]
             evidence["events"] = [
                 {
                     "type": i.type,
@@ -78,76 +147,115 @@ async def k8s_collect_evidence(namespace: Optional[str], pod: Optional[str], nod
                     "first_timestamp": str(i.first_timestamp),
                     "last_timestamp": str(i.last_timestamp),
                 }
-                for i in (ev.items or [])
+                for i in items
             ]
         except Exception as e:
             evidence["events_error"] = str(e)
 
-        # Logs (try each container)
-        try:
-            p = v1.read_namespaced_pod(name=pod, namespace=namespace)
-            logs = {}
-            for c in (p.spec.containers or []):
-                cname = c.name
-                try:
-                    text = v1.read_namespaced_pod_log(
+        # Logs (each container, fetched concurrently)
+        if containers is None:
+            evidence["logs_error"] = evidence["pod_info_error"]
+        else:
+            results = await asyncio.gather(
+                *(
+                    _k8s_call(
+                        v1.read_namespaced_pod_log,
                         name=pod,
                         namespace=namespace,
                         container=cname,
                         tail_lines=200,
                         timestamps=True,
                     )
-                    logs[cname] = text
-                except Exception as e:
-                    logs[cname] = f"<log_error> {e}"
-            evidence["logs"] = logs
-        except Exception as e:
-            evidence["logs_error"] = str(e)
+                    for cname in containers
+                ),
+                return_exceptions=True,
+            )
+            evidence["logs"] = {
+                cname: f"<log_error> {r}" if isinstance(r, Exception) else r
+                for cname, r in zip(containers, results)
+            }
 
     return evidence
 
 
-async def prom_collect_metrics(prometheus_url: str, namespace: Optional[str], pod: Optional[str], node: Optional[str]) -> Dict[str, Any]:
+# Alert storms repeat the same queries within seconds; evaluate them at a
+# time snapped to PROM_CACHE_SECONDS so repeats share one upstream response.
+PROM_CACHE_SECONDS = 30
+PROM_CACHE = AsyncTTLCache(maxsize=1024, ttl=PROM_CACHE_SECONDS)
+
+
+async def _prom_query(http: httpx.AsyncClient, prometheus_url: str, query: str) -> Dict[str, Any]:
+    bucket = int(time.time() // PROM_CACHE_SECONDS)
+
+    async def fetch() -> Dict[str, Any]:
+        r = await http.get(
+            f"{prometheus_url}/api/v1/query",
+            params={"query": query, "time": str(bucket * PROM_CACHE_SECONDS)},
+        )
+        return orjson.loads(r.content)
+
+    return await PROM_CACHE.get_or_set((prometheus_url, query, bucket), fetch)
+
+
+# PromQL templates with a fixed label order, so the same target always yields
+# byte-identical query strings (and therefore PROM_CACHE hits).
+Q_POD_CPU = 'sum(rate(container_cpu_usage_seconds_total{{namespace="{namespace}",pod="{pod}",container!=""}}[5m]))'
+Q_POD_MEM = 'sum(container_memory_working_set_bytes{{namespace="{namespace}",pod="{pod}",container!=""}})'
+Q_NODE_CPU = 'sum(rate(node_cpu_seconds_total{{instance=~"{node}.*",mode!="idle"}}[5m]))'
+
+# Result key -> key under which the PromQL string is reported
+_QUERY_KEYS = {
+    "pod_cpu": "pod_cpu_query",
+    "pod_memory": "pod_mem_query",
+    "node_cpu": "node_cpu_query",
+}
+
+
+async def prom_collect_metrics(http: httpx.AsyncClient, prometheus_url: str, namespace: Optional[str], pod: Optional[str], node: Optional[str]) -> Dict[str, Any]:
     """
     Minimal useful metrics evidence:
     - CPU rate for pod
     - Memory working set for pod
     - Node readiness condition already captured in kube-state-metrics alert, but add node CPU usage if node known.
     """
+    queries: Dict[str, str] = {}
+    # Pod CPU + memory
+    if namespace and pod:
+        queries["pod_cpu"] = Q_POD_CPU.format(namespace=namespace, pod=pod)
+        queries["pod_memory"] = Q_POD_MEM.format(namespace=namespace, pod=pod)
+
+    # Node CPU (optional)
+    if node:
+        queries["node_cpu"] = Q_NODE_CPU.format(node=node)
+
+    # Independent instant queries: issue them together over the shared pool
+    responses = await asyncio.gather(
+        *(_prom_query(http, prometheus_url, q) for q in queries.values())
+    )
+
     out: Dict[str, Any] = {}
-    async with httpx.AsyncClient(timeout=20) as x:
-        # Pod CPU
-        if namespace and pod:
-            q_cpu = f'sum(rate(container_cpu_usage_seconds_total{{namespace="{namespace}",pod="{pod}",container!=""}}[5m]))'
-            r = await x.get(f"{prometheus_url}/api/v1/query", params={"query": q_cpu})
-            out["pod_cpu_query"] = q_cpu
-            out["pod_cpu"] = r.json()
-
-            # Pod memory
-            q_mem = f'sum(container_memory_working_set_bytes{{namespace="{namespace}",pod="{pod}",container!=""}})'
-            r2 = await x.get(f"{prometheus_url}/api/v1/query", params={"query": q_mem})
-            out["pod_mem_query"] = q_mem
-            out["pod_memory"] = r2.json()
-
-        # Node CPU (optional)
-        if node:
-            q_ncpu = f'sum(rate(node_cpu_seconds_total{{instance=~"{node}.*",mode!="idle"}}[5m]))'
-            r3 = await x.get(f"{prometheus_url}/api/v1/query", params={"query": q_ncpu})
-            out["node_cpu_query"] = q_ncpu
-            out["node_cpu"] = r3.json()
+    for (name, q), r in zip(queries.items(), responses):
+        out[_QUERY_KEYS[name]] = q
+        out[name] = r
 
     return out
 
 
-async def loki_collect_logs(loki_url: str, namespace: str, pod: str, minutes: int = 20) -> Dict[str, Any]:
+LOKI_CACHE_SECONDS = 10
+LOKI_CACHE = AsyncTTLCache(maxsize=1024, ttl=LOKI_CACHE_SECONDS)
+
+
+async def loki_collect_logs(http: httpx.AsyncClient, loki_url: str, namespace: str, pod: str, minutes: int = 20) -> Dict[str, Any]:
     """
     Loki query for recent logs for the pod.
+    The range end is snapped to LOKI_CACHE_SECONDS so repeated alerts for the
+    same pod share one cached response.
     """
-    end = dt.datetime.utcnow()
-    start = end - dt.timedelta(minutes=minutes)
+    end_s = (int(time.time()) // LOKI_CACHE_SECONDS) * LOKI_CACHE_SECONDS
+    start_s = end_s - minutes * 60
     # Loki uses nanoseconds epoch for query_range
-    start_ns = int(start.timestamp() * 1e9)
-    end_ns = int(end.timestamp() * 1e9)
+    start_ns = start_s * 1_000_000_000
+    end_ns = end_s * 1_000_000_000
 
     # Common Loki labels for promtail on k8s: namespace, pod
     query = f'{{namespace="{namespace}", pod="{pod}"}}'
@@ -159,6 +267,9 @@ async def loki_collect_logs(loki_url: str, namespace: str, pod: str, minutes: in
         "direction": "BACKWARD",
     }
 
-    async with httpx.AsyncClient(timeout=20) as x:
-        r = await x.get(f"{loki_url}/loki/api/v1/query_range", params=params)
-        return {"query": query, "range_minutes": minutes, "response": r.json()}
+    async def fetch() -> Dict[str, Any]:
+        r = await http.get(f"{loki_url}/loki/api/v1/query_range", params=params)
+        return orjson.loads(r.content)
+
+    response = await LOKI_CACHE.get_or_set((loki_url, namespace, pod, minutes, end_s), fetch)
+    return {"query": query, "range_minutes": minutes, "response": response}
@@ -1,7 +1,7 @@
 import httpx
 
 
-async def create_github_issue(token: str, repo: str, title: str, body: str):
+async def create_github_issue(http: httpx.AsyncClient, token: str, repo: str, title: str, body: str):
     """
     repo format: owner/repo
     """
@@ -13,8 +13,7 @@ async def create_github_issue(token: str, repo: str, title: str, body: str):
     }
     payload = {"title": title, "body": body}
 
-    async with httpx.AsyncClient(timeout=20) as x:
-        r = await x.post(url, headers=headers, json=payload)
-        r.raise_for_status()
-        data = r.json()
-        return data.get("html_url")
+    r = await http.post(url, headers=headers, json=payload)
+    r.raise_for_status()
+    data = r.json()
+    return data.get("html_url")
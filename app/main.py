@@ -1,17 +1,25 @@
 import os
-import json
 import uuid
+import hashlib
+import logging
+import asyncio
+from contextlib import AsyncExitStack
 import datetime as dt
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+import aioboto3
 import httpx
+import orjson
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 from app.collectors import (
+    k8s_api_client,
     k8s_collect_evidence,
     prom_collect_metrics,
     loki_collect_logs,
+    PROM_CACHE,
+    LOKI_CACHE,
 )
 from app.triage import bedrock_triage_markdown
 from app.storage import s3_put_json, s3_put_text
@@ -20,6 +28,7 @@ from app.slack import send_slack_webhook
 
 
 APP = FastAPI(title="k8s-ai-incident-triage", version="1.0.0")
+LOG = logging.getLogger(__name__)
 
 # Config from env (ConfigMap + Secret)
 AWS_REGION = os.getenv("AWS_REGION", "ap-south-1")
@@ -33,23 +42,67 @@ SLACK_WEBHOOK_URL = os.getenv("SLACK_WEBHOOK_URL", "")
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN", "")
 GITHUB_REPO = os.getenv("GITHUB_REPO", "")  # owner/repo
 
+MAX_CONCURRENT_TRIAGES = int(os.getenv("MAX_CONCURRENT_TRIAGES", "10"))
+
+# Alert fingerprint -> running triage, and a cap on parallel triages
+INFLIGHT: Dict[str, asyncio.Task] = {}
+TRIAGE_SEM = asyncio.Semaphore(MAX_CONCURRENT_TRIAGES)
+
+
+@APP.on_event("startup")
+async def _startup() -> None:
+    # One pooled client for Prometheus, Loki, GitHub and Slack (keep-alive + HTTP/2)
+    APP.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(20.0, connect=5.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    )
+    APP.state.k8s = await k8s_api_client()
+
+    # aioboto3 clients are context managers; keep them open for the app lifetime
+    APP.state.aws = AsyncExitStack()
+    session = aioboto3.Session()
+    APP.state.s3 = await APP.state.aws.enter_async_context(session.client("s3"))
+    APP.state.bedrock = await APP.state.aws.enter_async_context(
+        session.client("bedrock-runtime", region_name=AWS_REGION)
+    )
+
+
+@APP.on_event("shutdown")
+async def _shutdown() -> None:
+    await APP.state.http.aclose()
+    await APP.state.k8s.close()
+    await APP.state.aws.aclose()
+
 
 @APP.get("/health")
 def health():
     return {"ok": True}
 
 
-def _now_utc_iso() -> str:
-    return dt.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+@APP.get("/metrics")
+def metrics():
+    # Prometheus text exposition for the collector caches
+    lines = []
+    for name, cache in (("prom", PROM_CACHE), ("loki", LOKI_CACHE)):
+        lines += [
+            f"# TYPE {name}_cache_hits_total counter",
+            f"{name}_cache_hits_total {cache.hits}",
+            f"# TYPE {name}_cache_misses_total counter",
+            f"{name}_cache_misses_total {cache.misses}",
+        ]
+    return PlainTextResponse("\n".join(lines) + "\n")
 
 
-def _safe_get(d: Dict[str, Any], path: List[str], default=None):
-    cur = d
-    for p in path:
-        if not isinstance(cur, dict) or p not in cur:
-            return default
-        cur = cur[p]
-    return cur
+def _new_incident() -> Tuple[str, str]:
+    """
+    Returns (incident_id, created_at) from a single clock read.
+    The id is time-prefixed (e.g. 20240101T120000Z-1a2b3c4d5e6f) so ids and
+    their S3 keys sort by creation time.
+    """
+    now = dt.datetime.utcnow().replace(microsecond=0)
+    incident_id = now.strftime("%Y%m%dT%H%M%SZ-") + uuid.uuid4().hex[:12]
+    return incident_id, now.isoformat() + "Z"
 
 
 def _extract_targets_from_alert(alert: Dict[str, Any]) -> Dict[str, Optional[str]]:
@@ -67,22 +120,18 @@ def _extract_targets_from_alert(alert: Dict[str, Any]) -> Dict[str, Optional[str
     }
 
 
-@APP.post("/alert")
-async def alertmanager_webhook(req: Request):
+async def _triage(app: FastAPI, status: str, alert_summaries: List[Dict[str, Optional[str]]]) -> Dict[str, Any]:
     """
-    Receives Alertmanager webhook payload.
     Collects evidence (K8s + Prom + Loki), calls Bedrock LLM, sends Slack,
     creates GitHub issue, stores everything to S3.
     """
-    body = await req.json()
-    status = body.get("status", "unknown")
-    alerts = body.get("alerts", []) or []
+    http = app.state.http
+    k8s_api = app.state.k8s
+    s3 = app.state.s3
 
-    incident_id = str(uuid.uuid4())
-    created_at = _now_utc_iso()
+    incident_id, created_at = _new_incident()
 
     # Basic info
-    alert_summaries = [_extract_targets_from_alert(a) for a in alerts]
     primary = alert_summaries[0] if alert_summaries else {}
 
     # Evidence collection
@@ -90,25 +139,36 @@ async def alertmanager_webhook(req: Request):
     pod = primary.get("pod")
     node = primary.get("node")
 
-    k8s_evidence = await k8s_collect_evidence(namespace=namespace, pod=pod, node=node)
+    # K8s, Prometheus and Loki are independent round trips; run them together
+    async def _skip() -> Dict[str, Any]:
+        return {}
 
-    prom_evidence = {}
+    tasks = [k8s_collect_evidence(api=k8s_api, namespace=namespace, pod=pod, node=node)]
     if PROMETHEUS_URL:
-        prom_evidence = await prom_collect_metrics(
+        tasks.append(prom_collect_metrics(
+            http=http,
             prometheus_url=PROMETHEUS_URL,
             namespace=namespace,
             pod=pod,
             node=node,
-        )
-
-    loki_evidence = {}
+        ))
+    else:
+        tasks.append(_skip())
     if LOKI_URL and namespace and pod:
-        loki_evidence = await loki_collect_logs(
+        tasks.append(loki_collect_logs(
+            http=http,
             loki_url=LOKI_URL,
             namespace=namespace,
             pod=pod,
             minutes=20,
-        )
+        ))
+    else:
+        tasks.append(_skip())
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    k8s_evidence, prom_evidence, loki_evidence = [
+        {"error": str(r)} if isinstance(r, Exception) else r for r in results
+    ]
 
     evidence_bundle = {
         "incident_id": incident_id,
@@ -120,49 +180,16 @@ async def alertmanager_webhook(req: Request):
         "loki": loki_evidence,
     }
 
-    # LLM triage
-    triage_md = await bedrock_triage_markdown(
-        region=AWS_REGION,
-        model_id=BEDROCK_MODEL_ID,
-        evidence=evidence_bundle,
-    )
-
-    # Store to S3 (optional but recommended)
-    s3_prefix = f"incidents/{created_at.replace(':','-')}_{incident_id}"
+    # S3 keys are known up front so every notification can reference them
+    s3_prefix = f"incidents/{incident_id}"
     s3_urls = {}
     if S3_BUCKET:
-        await s3_put_json(bucket=S3_BUCKET, key=f"{s3_prefix}/evidence.json", data=evidence_bundle)
-        await s3_put_text(bucket=S3_BUCKET, key=f"{s3_prefix}/runbook.md", text=triage_md)
         s3_urls = {
             "evidence_key": f"{s3_prefix}/evidence.json",
             "runbook_key": f"{s3_prefix}/runbook.md",
         }
 
-    # GitHub issue
-    issue_url = None
-    if GITHUB_TOKEN and GITHUB_REPO:
-        title = f"[{primary.get('severity','info')}] {primary.get('alertname','Alert')} - {namespace}/{pod or node or 'unknown'}"
-        issue_body = (
-            f"### Incident ID\n`{incident_id}`\n\n"
-            f"### Created\n{created_at}\n\n"
-            f"### Alerts\n```json\n{json.dumps(alert_summaries, indent=2)}\n```\n\n"
-            f"### Runbook (AI)\n{triage_md}\n\n"
-        )
-        if S3_BUCKET and s3_urls:
-            issue_body += (
-                f"\n### Artifacts (S3)\n"
-                f"- evidence: `s3://{S3_BUCKET}/{s3_urls['evidence_key']}`\n"
-                f"- runbook:  `s3://{S3_BUCKET}/{s3_urls['runbook_key']}`\n"
-            )
-        issue_url = await create_github_issue(
-            token=GITHUB_TOKEN,
-            repo=GITHUB_REPO,
-            title=title,
-            body=issue_body,
-        )
-
-    # Slack notification
-    if SLACK_WEBHOOK_URL:
+    def _slack_text(excerpt: str, issue_url: Optional[str], link_s3: bool = True) -> str:
         short = (
             f"*K8s Incident Triage*\n"
             f"*Status:* `{status}`\n"
@@ -172,19 +199,127 @@ async def alertmanager_webhook(req: Request):
         )
         if issue_url:
             short += f"*GitHub Issue:* {issue_url}\n"
-        if S3_BUCKET and s3_urls:
+        if link_s3 and S3_BUCKET and s3_urls:
             short += f"*S3:* `s3://{S3_BUCKET}/{s3_urls['runbook_key']}`\n"
+        return f"{short}\n```{excerpt}```"
 
-        # Include first ~20 lines of runbook for Slack readability
-        excerpt = "\n".join(triage_md.splitlines()[:20])
-        slack_text = f"{short}\n```{excerpt}```"
-        await send_slack_webhook(SLACK_WEBHOOK_URL, slack_text)
-
-    return JSONResponse(
-        {
-            "ok": True,
-            "incident_id": incident_id,
-            "issue_url": issue_url,
-            "s3": s3_urls,
-        }
-    )
+    # Without a GitHub issue to link, Slack only needs the first ~20 runbook
+    # lines: post it as soon as they stream in, overlapping the rest of the LLM call.
+    slack_task: Optional[asyncio.Task] = None
+
+    def _on_excerpt(excerpt: str) -> None:
+        nonlocal slack_task
+        slack_task = asyncio.create_task(
+            # Posted before the S3 uploads run, so it cannot link the runbook yet
+            send_slack_webhook(http, SLACK_WEBHOOK_URL, _slack_text(excerpt, None, link_s3=False))
+        )
+
+    slack_early = bool(SLACK_WEBHOOK_URL) and not (GITHUB_TOKEN and GITHUB_REPO)
+
+    try:
+        # LLM triage
+        triage_md = await bedrock_triage_markdown(
+            client=app.state.bedrock,
+            model_id=BEDROCK_MODEL_ID,
+            evidence=evidence_bundle,
+            on_excerpt=_on_excerpt if slack_early else None,
+        )
+
+        # Store to S3 first (both uploads in parallel) so GitHub/Slack never link
+        # keys that were not written. An S3 failure is reported, not fatal: failing
+        # the request would make Alertmanager retry and open a new issue each time.
+        s3_error = None
+        if S3_BUCKET:
+            results = await asyncio.gather(
+                s3_put_json(s3=s3, bucket=S3_BUCKET, key=s3_urls["evidence_key"], data=evidence_bundle),
+                s3_put_text(s3=s3, bucket=S3_BUCKET, key=s3_urls["runbook_key"], text=triage_md),
+                return_exceptions=True,
+            )
+            errors = [str(r) for r in results if isinstance(r, Exception)]
+            if errors:
+                s3_error = "; ".join(errors)
+                s3_urls = {}
+
+        # GitHub issue
+        issue_url = None
+        if GITHUB_TOKEN and GITHUB_REPO:
+            title = f"[{primary.get('severity','info')}] {primary.get('alertname','Alert')} - {namespace}/{pod or node or 'unknown'}"
+            issue_body = (
+                f"### Incident ID\n`{incident_id}`\n\n"
+                f"### Created\n{created_at}\n\n"
+                f"### Alerts\n```json\n{orjson.dumps(alert_summaries, option=orjson.OPT_INDENT_2).decode()}\n```\n\n"
+                f"### Runbook (AI)\n{triage_md}\n\n"
+            )
+            if S3_BUCKET and s3_urls:
+                issue_body += (
+                    f"\n### Artifacts (S3)\n"
+                    f"- evidence: `s3://{S3_BUCKET}/{s3_urls['evidence_key']}`\n"
+                    f"- runbook:  `s3://{S3_BUCKET}/{s3_urls['runbook_key']}`\n"
+                )
+            issue_url = await create_github_issue(
+                http=http,
+                token=GITHUB_TOKEN,
+                repo=GITHUB_REPO,
+                title=title,
+                body=issue_body,
+            )
+
+        # Slack notification (after GitHub so it can link the issue)
+        if slack_task is not None:
+            await slack_task
+        elif SLACK_WEBHOOK_URL:
+            # Include first ~20 lines of runbook for Slack readability
+            excerpt = "\n".join(triage_md.splitlines()[:20])
+            await send_slack_webhook(http, SLACK_WEBHOOK_URL, _slack_text(excerpt, issue_url))
+    finally:
+        # Error path: stop an early Slack post that is still in flight for a
+        # request that is about to fail, and retrieve its outcome either way.
+        if slack_task is not None:
+            if not slack_task.done():
+                slack_task.cancel()
+            await asyncio.gather(slack_task, return_exceptions=True)
+
+    out = {
+        "ok": True,
+        "incident_id": incident_id,
+        "issue_url": issue_url,
+        "s3": s3_urls,
+    }
+    if s3_error:
+        out["s3_error"] = s3_error
+    return out
+
+
+def _log_triage_failure(fp: str, task: asyncio.Task) -> None:
+    # Every caller may have disconnected; make sure a failure is still visible
+    if not task.cancelled() and task.exception() is not None:
+        LOG.error("triage %s failed", fp, exc_info=task.exception())
+
+
+async def _triage_limited(app: FastAPI, status: str, alert_summaries: List[Dict[str, Optional[str]]]) -> Dict[str, Any]:
+    async with TRIAGE_SEM:
+        return await _triage(app, status, alert_summaries)
+
+
+@APP.post("/alert")
+async def alertmanager_webhook(req: Request):
+    """
+    Receives Alertmanager webhook payload.
+    Repeated deliveries of an alert group that is still being triaged share
+    the in-flight run (same incident, same response) instead of starting a new one.
+    """
+    body = await req.json()
+    status = body.get("status", "unknown")
+    alerts = body.get("alerts", []) or []
+    alert_summaries = [_extract_targets_from_alert(a) for a in alerts]
+
+    fp = hashlib.sha1(orjson.dumps([status, alert_summaries])).hexdigest()
+    task = INFLIGHT.get(fp)
+    if task is None:
+        task = asyncio.create_task(_triage_limited(req.app, status, alert_summaries))
+        INFLIGHT[fp] = task
+        task.add_done_callback(lambda _: INFLIGHT.pop(fp, None))
+        task.add_done_callback(lambda t: _log_triage_failure(fp, t))
+
+    # shield: a disconnecting caller must not cancel the run others are awaiting
+    return JSONResponse(await asyncio.shield(task))
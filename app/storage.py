@@ -1,24 +1,41 @@
-import json
-from typing import Any, Dict
+import gzip
+from typing import Any, Dict, Tuple
 
-import boto3
+import orjson
 
+try:
+    import zstandard
+except ImportError:  # fall back to stdlib gzip
+    zstandard = None
 
-async def s3_put_json(bucket: str, key: str, data: Dict[str, Any]) -> None:
-    s3 = boto3.client("s3")
-    s3.put_object(
+
+_ZSTD = zstandard.ZstdCompressor(level=3) if zstandard else None
+
+
+def _compress(body: bytes) -> Tuple[bytes, str]:
+    """Returns (compressed body, Content-Encoding)."""
+    if _ZSTD:
+        return _ZSTD.compress(body), "zstd"
+    return gzip.compress(body, compresslevel=6), "gzip"
+
+
+async def s3_put_json(s3: Any, bucket: str, key: str, data: Dict[str, Any]) -> None:
+    body, encoding = _compress(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS))
+    await s3.put_object(
         Bucket=bucket,
         Key=key,
-        Body=json.dumps(data, indent=2).encode("utf-8"),
+        Body=body,
+        ContentEncoding=encoding,
         ContentType="application/json",
     )
 
 
-async def s3_put_text(bucket: str, key: str, text: str) -> None:
-    s3 = boto3.client("s3")
-    s3.put_object(
+async def s3_put_text(s3: Any, bucket: str, key: str, text: str) -> None:
+    body, encoding = _compress(text.encode("utf-8"))
+    await s3.put_object(
         Bucket=bucket,
         Key=key,
-        Body=text.encode("utf-8"),
+        Body=body,
+        ContentEncoding=encoding,
         ContentType="text/markdown",
     )
@@ -1,7 +1,6 @@
-import json
-from typing import Any, Dict
+from typing import Any, Callable, Dict, List, Optional
 
-import boto3
+import orjson
 
 
 SYSTEM_STYLE = """You are an SRE incident triage assistant for Kubernetes.
@@ -24,21 +23,98 @@ OUTPUT_FORMAT = """Return Markdown with these sections exactly:
 """
 
 
+# Lines of the runbook handed to on_excerpt (the Slack preview)
+EXCERPT_LINES = 20
+
+# Prompt budget: the model only needs recent signal, so trim before serializing
+PROMPT_LOG_LINES = 50
+PROMPT_MAX_EVENTS = 20
+PROMPT_EVENT_MESSAGE_CHARS = 512
+
+
+def _tail_lines(text: Any, n: int) -> Any:
+    if not isinstance(text, str):
+        return text
+    return "\n".join(text.splitlines()[-n:])
+
+
+def _event_ts(e: Dict[str, Any]) -> str:
+    ts = e.get("last_timestamp")
+    return "" if ts in (None, "None") else ts
+
+
+def _compact_events(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    recent = sorted(events, key=_event_ts, reverse=True)[:PROMPT_MAX_EVENTS]
+    out = []
+    for e in recent:
+        e = dict(e)
+        if isinstance(e.get("message"), str):
+            e["message"] = e["message"][:PROMPT_EVENT_MESSAGE_CHARS]
+        out.append(e)
+    return out
+
+
+def _compact_evidence(ev: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns a trimmed copy of the evidence bundle for the prompt.
+    The input is not modified (the full bundle still goes to S3).
+    """
+    ev = dict(ev)
+    k8s = ev.get("k8s")
+    if isinstance(k8s, dict):
+        k8s = dict(k8s)
+        if isinstance(k8s.get("events"), list):
+            k8s["events"] = _compact_events(k8s["events"])
+        if isinstance(k8s.get("logs"), dict):
+            k8s["logs"] = {c: _tail_lines(t, PROMPT_LOG_LINES) for c, t in k8s["logs"].items()}
+        ev["k8s"] = k8s
+
+    # Loki streams come back newest-first (direction=BACKWARD)
+    loki = ev.get("loki")
+    result = (((loki or {}).get("response") or {}).get("data") or {}).get("result")
+    if isinstance(result, list):
+        data = dict(loki["response"]["data"])
+        data["result"] = [
+            {"stream": r.get("stream"), "values": (r.get("values") or [])[:PROMPT_LOG_LINES]}
+            for r in result
+        ]
+        data.pop("stats", None)
+        ev["loki"] = {**loki, "response": {**loki["response"], "data": data}}
+    return ev
+
+
+# Constant part of the prompt, built once at import
+_PROMPT_PREFIX = f"{SYSTEM_STYLE}\n\n{OUTPUT_FORMAT}\n\n### Evidence JSON\n```json\n"
+_PROMPT_SUFFIX = "\n```"
+
+
 def _build_prompt(evidence: Dict[str, Any]) -> str:
-    # Keep prompt bounded. We include key parts, and trim large logs if needed.
-    safe = json.dumps(evidence, indent=2)
+    # Keep prompt bounded: trim the evidence first, then hard-cap the JSON size.
+    safe = orjson.dumps(_compact_evidence(evidence), option=orjson.OPT_NON_STR_KEYS).decode()
     if len(safe) > 120000:
         safe = safe[:120000] + "\n...<truncated>..."
-    return f"{SYSTEM_STYLE}\n\n{OUTPUT_FORMAT}\n\n### Evidence JSON\n```json\n{safe}\n```"
+    return "".join((_PROMPT_PREFIX, safe, _PROMPT_SUFFIX))
+
+
+def _excerpt(text: str) -> str:
+    return "\n".join(text.splitlines()[:EXCERPT_LINES])
 
 
-async def bedrock_triage_markdown(region: str, model_id: str, evidence: Dict[str, Any]) -> str:
+async def bedrock_triage_markdown(
+    client: Any,
+    model_id: str,
+    evidence: Dict[str, Any],
+    on_excerpt: Optional[Callable[[str], None]] = None,
+) -> str:
     """
-    Uses Bedrock Runtime invoke_model.
+    Uses Bedrock Runtime invoke_model_with_response_stream on the shared
+    (aioboto3) bedrock-runtime client.
     This implementation targets Anthropic Claude models on Bedrock.
     If you change to a different model family later, adjust request format.
+    If on_excerpt is given, it is called once with the first EXCERPT_LINES
+    lines as soon as they have streamed in (or with the full text if shorter),
+    so callers can start notifying while the model is still generating.
     """
-    client = boto3.client("bedrock-runtime", region_name=region)
     prompt = _build_prompt(evidence)
 
     body = {
@@ -50,19 +126,34 @@ async def bedrock_triage_markdown(region: str, model_id: str, evidence: Dict[str
         ],
     }
 
-    resp = client.invoke_model(
+    text_parts: List[str] = []
+    newlines = 0
+    resp = await client.invoke_model_with_response_stream(
         modelId=model_id,
-        body=json.dumps(body).encode("utf-8"),
+        body=orjson.dumps(body),
         contentType="application/json",
         accept="application/json",
     )
-    payload = json.loads(resp["body"].read())
-
-    # Claude on Bedrock returns content array
-    content = payload.get("content", [])
-    text_parts = []
-    for c in content:
-        if c.get("type") == "text":
-            text_parts.append(c.get("text", ""))
-    out = "\n".join(text_parts).strip()
-    return out or "## Summary\nNo response from model."
+    async for event in resp["body"]:
+        chunk = event.get("chunk")
+        if not chunk:
+            continue
+        payload = orjson.loads(chunk["bytes"])
+
+        # Claude on Bedrock streams content blocks as text deltas
+        if payload.get("type") == "content_block_start" and text_parts:
+            text_parts.append("\n")
+        elif payload.get("type") == "content_block_delta" and payload["delta"].get("type") == "text_delta":
+            text = payload["delta"].get("text", "")
+            text_parts.append(text)
+            newlines += text.count("\n")
+            if on_excerpt and newlines >= EXCERPT_LINES:
+                head = "".join(text_parts).lstrip()
+                if head.count("\n") >= EXCERPT_LINES:
+                    on_excerpt(_excerpt(head))
+                    on_excerpt = None
+
+    out = "".join(text_parts).strip() or "## Summary\nNo response from model."
+    if on_excerpt:
+        on_excerpt(_excerpt(out))
+    return out